@@ -1,13 +1,18 @@
 import re
 import os
+import sys
 import time
-import threading
-import requests
-import hashlib
+import socket
 import asyncio
-from telethon import TelegramClient, events
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from telethon import TelegramClient, events, utils
 from telethon.sessions import StringSession
-from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional
+import aiohttp
 from aiohttp import web
 
 # =============================
@@ -22,6 +27,7 @@ SESSION_STRING = os.environ.get("SESSION_STRING", "")
 RENDER_URL = os.environ.get("RENDER_URL")           # e.g. https://your-app.onrender.com
 PORT = int(os.environ.get("PORT", 10000))
 DUPLICATE_WINDOW = int(os.environ.get("DUPLICATE_WINDOW", 5))  # seconds
+PING_INTERVAL = 300  # seconds
 
 # Initialize Telegram client
 if SESSION_STRING:
@@ -32,223 +38,433 @@ else:
 # =============================
 # HELPERS
 # =============================
-IST = timezone(timedelta(hours=5, minutes=30))
-def now_ist():
-    return datetime.now(IST)
+IST_OFFSET = 5 * 3600 + 30 * 60  # IST is UTC+05:30 with no DST, in seconds
+
+@lru_cache(maxsize=2)
+def format_ist_second(sec: int) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(sec + IST_OFFSET))
+
+def now_ist_str() -> str:
+    """IST 'YYYY-MM-DD HH:MM:SS', formatted at most once per second"""
+    return format_ist_second(int(time.time()))
+
+# Log lines carry an IST HH:MM:SS prefix; %-style args are only formatted
+# when a record is actually emitted. Records go through a queue so the
+# stdout write happens on the listener thread, not the event loop.
+log_formatter = logging.Formatter("[%(asctime)s] %(message)s", datefmt="%H:%M:%S")
+log_formatter.converter = lambda secs: time.gmtime(secs + IST_OFFSET)
+log_handler = logging.StreamHandler(sys.stdout)  # same stream the old print() calls used
+log_handler.setFormatter(log_formatter)
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, log_handler)
+log = logging.getLogger("forwarder")
+log.addHandler(QueueHandler(log_queue))
+log.setLevel(logging.INFO)
+log.propagate = False
+
+# Timestamps below are time.monotonic() floats, so expiry checks are a
+# plain float compare
+processed_messages = OrderedDict()  # {hash_key: timestamp}, oldest first
+PROCESSED_MAX = 4096     # cap on remembered forwards, oldest dropped first
+PROCESSED_TTL = 24 * 3600.0  # seconds
+PRUNE_INTERVAL = 300     # seconds between sweeps of expired dedup records
+recent_signals = OrderedDict()  # {(pair, is_signal): timestamp}, oldest first
+RECENT_MAX = 4096        # cap on remembered pairs, oldest dropped first
+last_web_activity = time.monotonic()  # last request served by the web server
+source_peer = None       # InputPeer for SOURCE_CHANNEL, resolved in main()
+target_peer = None       # InputPeer for TARGET_CHANNEL, resolved in main()
+send_queue = None        # asyncio.Queue of (msg_hash, processed_text, original_text), created in main()
 
-processed_messages = {}  # {hash_key: timestamp}
-recent_signals = {}      # {pair: timestamp}
 
-
-def get_message_hash(text: str) -> str:
-    """Generate a stable hash for message text"""
-    return hashlib.sha256(text.strip().lower().encode()).hexdigest()
+# =============================
+# REGEX PATTERNS (compiled once)
+# =============================
+PAIR_RE = re.compile(r"([A-Z]{2,10})/?([A-Z]{2,10})?")
+# Direction / leverage / entry / target / SL in one alternation, collected in
+# a single scan; each branch has exactly one named group, read via lastgroup.
+# Matched against the lowercased text, so no IGNORECASE folding per char
+SIGNAL_FIELDS_RE = re.compile(
+    r"\b(?P<direction>long|short|buy|sell)\b"
+    r"|leverage\s*[-:]?\s*(?P<leverage>[0-9]+x)"
+    r"|(?:entry|entries)\s*[-:]?\s*(?P<entry>[\d.]+)"
+    r"|target\s*(?:1)?\s*[-:]?\s*(?P<target>[\d.]+)"
+    r"|sl\s*[-:]?\s*(?P<sl>[\d.]+)"
+)
+# Matched against the lowercased text, so no IGNORECASE folding per char
+CANCEL_RE = re.compile(r"#?([a-z0-9]{1,10})/?([a-z0-9]{1,10})?\s+manually\s+cancelled")
 
 
 # =============================
 # MESSAGE PARSER / FORMATTER
 # =============================
-def format_signal_message(text: str):
-    text = re.sub(r"[^\S\r\n]+", " ", text)
-    lines = [l.strip() for l in text.splitlines() if l.strip()]
+# Direction words as captured from the lowered text -> output action
+DIRECTIONS = {"long": "LONG", "buy": "LONG", "short": "SHORT", "sell": "SHORT"}
+
+SIGNAL_TEMPLATE = (
+    "Action: {direction}\n"
+    "Symbol: #{pair}\n"
+    "--- ⌁ ---\n"
+    "Exchange: Binance Futures\n"
+    "Leverage: Cross ({leverage})\n"
+    "--- ⌁ ---\n"
+    "☑️ Entry Price: {entry}\n"
+    "☑️ Take-Profit: {target}\n"
+    "☑️ Stop Loss: {sl}"
+)
+
+
+@lru_cache(maxsize=512)
+def make_pair(base: str, quote: str) -> str:
+    """Uppercase trading pair; the same few tickers recur, so reuse one object"""
+    return sys.intern(f"{base}{quote}".upper())
+
+
+def format_signal_message(text: str, lowered: Optional[str] = None):
+    """Returns (formatted_message, pair), or (None, None) if not a signal"""
+    # Every signal needs entry, target and SL keywords; substring checks on
+    # the lowered copy reject the rest before any regex runs
+    if lowered is None:
+        lowered = text.lower()
+    if not ("entr" in lowered and "target" in lowered and "sl" in lowered):
+        return None, None
 
     # Try to detect main components flexibly
-    pair_match = re.search(r"([A-Z]{2,10})/?([A-Z]{2,10})?", text)
-    direction_match = re.search(r"\b(LONG|SHORT|BUY|SELL)\b", text, re.IGNORECASE)
-    leverage_match = re.search(r"Leverage\s*[-:]?\s*([0-9]+x)", text, re.IGNORECASE)
-    entry_match = re.search(r"(?:Entry|Entries)\s*[-:]?\s*([\d.]+)", text, re.IGNORECASE)
-    target_match = re.search(r"Target\s*(?:1)?\s*[-:]?\s*([\d.]+)", text, re.IGNORECASE)
-    sl_match = re.search(r"SL\s*[-:]?\s*([\d.]+)", text, re.IGNORECASE)
-
-    if not (pair_match and direction_match and entry_match and target_match and sl_match):
-        return None
-
-    base = pair_match.group(1)
-    quote = pair_match.group(2) or "USDT"
-    pair = f"{base}{quote}".upper()
-
-    direction_raw = direction_match.group(1).upper()
-    direction = "LONG" if direction_raw in ["LONG", "BUY"] else "SHORT"
-
-    leverage = leverage_match.group(1).upper() if leverage_match else "N/A"
-    entry = entry_match.group(1)
-    target = target_match.group(1)
-    sl = sl_match.group(1)
-
-    formatted = (
-        f"Action: {direction}\n"
-        f"Symbol: #{pair}\n"
-        f"--- ⌁ ---\n"
-        f"Exchange: Binance Futures\n"
-        f"Leverage: Cross ({leverage})\n"
-        f"--- ⌁ ---\n"
-        f"☑️ Entry Price: {entry}\n"
-        f"☑️ Take-Profit: {target}\n"
-        f"☑️ Stop Loss: {sl}"
-    )
-    return formatted
+    pair_match = PAIR_RE.search(text)
+
+    # First occurrence of each field wins, as with separate searches
+    fields = {}
+    for m in SIGNAL_FIELDS_RE.finditer(lowered):
+        key = m.lastgroup
+        if key not in fields:
+            fields[key] = m.group(key)
+            if len(fields) == 5:
+                break  # every field found, the rest of the text can be skipped
+
+    if not (pair_match and "direction" in fields
+            and "entry" in fields and "target" in fields and "sl" in fields):
+        return None, None
+
+    pair = make_pair(pair_match.group(1), pair_match.group(2) or "USDT")
+
+    direction = DIRECTIONS[fields["direction"]]
+
+    leverage = fields["leverage"].upper() if "leverage" in fields else "N/A"
+
+    formatted = SIGNAL_TEMPLATE.format_map({
+        "direction": direction,
+        "pair": pair,
+        "leverage": leverage,
+        "entry": fields["entry"],
+        "target": fields["target"],
+        "sl": fields["sl"],
+    })
+    return formatted, pair
 
 
 # =============================
 # MESSAGE PROCESSOR
 # =============================
-def process_message(text: str):
-    """Parses and converts messages to standard format"""
-    if not text:
-        return None, False
+# Shortest text either format can match: "X Manually Cancelled"
+MIN_MESSAGE_LEN = 20
+
+def process_message(text: str, lowered: Optional[str] = None):
+    """Parses and converts messages to standard format.
+
+    Returns (processed_text, is_signal, pair); `lowered` is `text.lower()`
+    when the caller already has it.
+    """
+    if not text or len(text) < MIN_MESSAGE_LEN:
+        return None, False, None
+
+    # Cheap substring checks first; the regexes only run when one can match
+    if lowered is None:
+        lowered = text.lower()
+    has_cancelled = "cancelled" in lowered
+    has_leverage = "leverage" in lowered
+    if not (has_cancelled or has_leverage):
+        return None, False, None
 
     # Handle manually cancelled signals
-    cancel_match = re.search(
-        r"#?([A-Z0-9]{1,10})/?([A-Z0-9]{1,10})?\s+Manually\s+Cancelled",
-        text,
-        re.IGNORECASE,
-    )
+    cancel_match = CANCEL_RE.search(lowered) if has_cancelled else None
     if cancel_match:
-        base = cancel_match.group(1)
-        quote = cancel_match.group(2) or "USDT"
-        pair = f"{base}{quote}".upper()
-        return f"/close #{pair}", False
+        pair = make_pair(cancel_match.group(1), cancel_match.group(2) or "usdt")
+        return f"/close #{pair}", False, pair
 
     # Handle standard leverage signals
-    if "leverage" in text.lower():
-        formatted = format_signal_message(text)
+    if has_leverage:
+        formatted, pair = format_signal_message(text, lowered)
         if formatted:
-            return formatted, True
+            return formatted, True, pair
 
-    return None, False
+    return None, False, None
 
 
 # =============================
 # MESSAGE HANDLER
 # =============================
-@client.on(events.NewMessage(chats=SOURCE_CHANNEL))
+# Registered in main() once the source channel has been resolved
 async def handler(event):
-    original_text = event.message.text or ""
-    now = now_ist()
+    original_text = event.message.text
+    if not original_text or len(original_text) < MIN_MESSAGE_LEN:
+        return
 
-    # Cleanup old records (24h)
-    for k in list(processed_messages.keys()):
-        if now - processed_messages[k] > timedelta(hours=24):
-            processed_messages.pop(k, None)
+    # process_message drops chatter with plain substring checks, so the
+    # timestamp and hashing below only run for forwardable messages.
+    # Only forwarded messages are ever recorded, so checking for duplicates
+    # afterwards skips exactly the same messages as before.
+    lowered = original_text.lower()
+    processed_text, is_signal, pair = process_message(original_text, lowered)
+    if not processed_text:
+        return
 
-    msg_hash = get_message_hash(original_text)
-    if msg_hash in processed_messages:
-        print(f"[{now.strftime('%H:%M:%S')}] [SKIP] Duplicate message hash.")
+    now = time.monotonic()
+
+    # Built-in str hash is plenty for an in-process dedup table. Expired
+    # records are swept by prune_processed(), so check the age here too.
+    msg_hash = hash(lowered.strip())
+    seen_at = processed_messages.get(msg_hash)
+    if seen_at is not None and now - seen_at <= PROCESSED_TTL:
+        log.info("[SKIP] Duplicate message hash.")
         return
 
-    processed_text, is_signal = process_message(original_text)
-    if not processed_text:
+    # Skip same pair within DUPLICATE_WINDOW; a close and a new signal for
+    # one pair are tracked separately so neither suppresses the other
+    key = (pair, is_signal)
+    last_time = recent_signals.get(key)
+    if last_time is not None and now - last_time < DUPLICATE_WINDOW:
+        log.info("[SKIP] Duplicate %s within %ss.", pair, DUPLICATE_WINDOW)
         return
 
-    # Skip same pair within DUPLICATE_WINDOW
-    pair_match = re.search(r"#?([A-Z]{2,10})(USDT|USD)?", processed_text, re.IGNORECASE)
-    if pair_match:
-        pair = pair_match.group(1).upper()
-        last_time = recent_signals.get(pair)
-        if last_time and (now - last_time).total_seconds() < DUPLICATE_WINDOW:
-            print(f"[{now.strftime('%H:%M:%S')}] [SKIP] Duplicate {pair} within {DUPLICATE_WINDOW}s.")
-            return
-        recent_signals[pair] = now
-
-    # Forward to target
-    await client.send_message(TARGET_CHANNEL, processed_text)
+    # Hand off to the sender task; recorded now so a quick repost is
+    # still caught while the send is in flight. sender() drops the hash
+    # record again if the send fails, so a later repost is forwarded.
+    try:
+        send_queue.put_nowait((msg_hash, processed_text, original_text))
+    except asyncio.QueueFull:
+        log.warning("[SKIP] Send queue full, dropping message.")
+        return
+    recent_signals[key] = now
+    recent_signals.move_to_end(key)
+    while len(recent_signals) > RECENT_MAX:
+        recent_signals.popitem(last=False)
     processed_messages[msg_hash] = now
+    processed_messages.move_to_end(msg_hash)  # keep time order for the sweep
+    while len(processed_messages) > PROCESSED_MAX:
+        processed_messages.popitem(last=False)
 
-    print(f"[{now.strftime('%H:%M:%S')}] ✅ Forwarded to target:")
-    if processed_text != original_text:
-        print(f"→ Converted:\n{processed_text}")
+
+async def sender():
+    """Forwards queued messages to the target one at a time, in arrival order"""
+    while True:
+        msg_hash, processed_text, original_text = await send_queue.get()
+        try:
+            await client.send_message(target_peer, processed_text)
+        except Exception as e:
+            log.error("[SendError] %s", e)
+            processed_messages.pop(msg_hash, None)  # not forwarded, allow a repost
+            continue
+
+        log.info("✅ Forwarded to target:")
+        log.debug("→ Original: %.50s", original_text)
+        if processed_text != original_text:
+            log.info("→ Converted:\n%s", processed_text)
+
+
+async def prune_processed():
+    """Drops dedup records that can no longer match, off the handler path"""
+    while True:
+        await asyncio.sleep(PRUNE_INTERVAL)
+        # Entries are in time order, so only the expired head is visited
+        now = time.monotonic()
+        cutoff = now - PROCESSED_TTL
+        while processed_messages and next(iter(processed_messages.values())) < cutoff:
+            processed_messages.popitem(last=False)
+        cutoff = now - DUPLICATE_WINDOW
+        while recent_signals and next(iter(recent_signals.values())) < cutoff:
+            recent_signals.popitem(last=False)
 
 
 # =============================
 # SELF-PING (RENDER KEEPALIVE)
 # =============================
-def self_ping():
-    """Pings its own Render URL every 5 minutes"""
-    if not RENDER_URL:
-        print("[WARN] No RENDER_URL set. Skipping ping.")
-        return
-    while True:
-        try:
-            resp = requests.get(f"{RENDER_URL}/ping", timeout=10)
-            if resp.status_code == 200:
-                print(f"[{now_ist().strftime('%H:%M:%S')}] 🔁 Ping OK → {RENDER_URL}/ping")
-            else:
-                print(f"[PingFail] {resp.status_code}")
-        except Exception as e:
-            print(f"[PingError] {e}")
-        time.sleep(300)  # every 5 min
+async def self_ping():
+    """Pings its own Render URL unless something else hit it in the last 5 minutes"""
+    timeout = aiohttp.ClientTimeout(total=10)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        while True:
+            idle = time.monotonic() - last_web_activity
+            if idle < PING_INTERVAL:
+                # Recent inbound traffic already keeps Render awake
+                await asyncio.sleep(PING_INTERVAL - idle)
+                continue
+            try:
+                async with session.get(f"{RENDER_URL}/ping") as resp:
+                    if resp.status == 200:
+                        log.info("🔁 Ping OK → %s/ping", RENDER_URL)
+                    else:
+                        log.warning("[PingFail] %s", resp.status)
+            except Exception as e:
+                log.warning("[PingError] %s", e)
+            await asyncio.sleep(PING_INTERVAL)
 
 
 # =============================
 # WEB SERVER
 # =============================
-async def health_check(request):
-    return web.Response(text="Bot is running!", status=200)
-
-async def status_page(request):
-    html = f"""
+@web.middleware
+async def track_activity(request, handler):
+    global last_web_activity
+    last_web_activity = time.monotonic()
+    response = await handler(request)
+    # Keep-alive and status responses must never be served from a cache
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+HEALTH_BODY = b"Bot is running!"
+
+# /ping JSON around the timestamp, same bytes json.dumps would produce
+PING_BODY_HEAD = b'{"status": "alive", "time": "'
+PING_BODY_TAIL = b'"}'
+
+# Channels are fixed at startup, so only time and count are spliced per request
+STATUS_HEAD = f"""
     <html><head><title>Telegram Forwarder Bot</title></head>
     <body>
     <h2>Telegram Forwarder Bot - Status</h2>
     <p><b>Status:</b> RUNNING</p>
     <p><b>Source:</b> {SOURCE_CHANNEL}</p>
     <p><b>Target:</b> {TARGET_CHANNEL}</p>
-    <p><b>Time:</b> {now_ist().strftime('%Y-%m-%d %H:%M:%S')}</p>
-    <p><b>Processed Messages:</b> {len(processed_messages)}</p>
+    <p><b>Time:</b> """.encode()
+STATUS_MID = b"""</p>
+    <p><b>Processed Messages:</b> """
+STATUS_TAIL = b"""</p>
     </body></html>
     """
-    return web.Response(text=html, content_type="text/html")
+
+async def health_check(request):
+    return web.Response(body=HEALTH_BODY, content_type="text/plain", charset="utf-8")
+
+async def status_page(request):
+    body = b"".join((
+        STATUS_HEAD,
+        now_ist_str().encode(),
+        STATUS_MID,
+        str(len(processed_messages)).encode(),
+        STATUS_TAIL,
+    ))
+    return web.Response(body=body, content_type="text/html", charset="utf-8")
 
 async def ping(request):
-    now = now_ist()
-    print(f"[{now.strftime('%H:%M:%S')}] 🏓 Ping received")
-    return web.json_response({"status": "alive", "time": now.strftime("%Y-%m-%d %H:%M:%S")})
+    log.info("🏓 Ping received")
+    body = PING_BODY_HEAD + now_ist_str().encode() + PING_BODY_TAIL
+    return web.Response(body=body, content_type="application/json", charset="utf-8")
 
 async def start_web_server():
-    app = web.Application()
+    app = web.Application(middlewares=[track_activity])
     app.router.add_get("/", status_page)
     app.router.add_get("/health", health_check)
     app.router.add_get("/ping", ping)
-    runner = web.AppRunner(app)
+    # No access log: uptime probes would otherwise format a line per request
+    runner = web.AppRunner(app, access_log=None)
     await runner.setup()
     site = web.TCPSite(runner, "0.0.0.0", PORT)
     await site.start()
-    print(f"[INFO] Web server running on port {PORT}")
+    log.info("[INFO] Web server running on port %s", PORT)
+
+
+# =============================
+# TELEGRAM CONNECTION
+# =============================
+def enable_tcp_keepalive():
+    """Let the kernel probe the MTProto socket so a dead link is noticed early.
+
+    Best effort: this reaches into Telethon's private connection object and
+    only covers the current socket, since a reconnect opens a new one.
+    """
+    try:
+        sock = client._sender._connection._writer.get_extra_info("socket")
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):  # Linux
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 30)
+        log.info("[INFO] TCP keepalive enabled on the Telegram connection.")
+    except (AttributeError, OSError) as e:
+        log.info("[INFO] TCP keepalive not enabled: %s", e)
 
 
 # =============================
 # MAIN
 # =============================
 async def main():
-    print("🚀 Starting Telegram Forwarder Bot...")
+    global source_peer, target_peer, send_queue
+    log.info("🚀 Starting Telegram Forwarder Bot...")
+    try:
+        import cryptg  # noqa: F401  (Telethon picks it up for MTProto AES)
+        log.info("[INFO] cryptg found, MTProto encryption is accelerated.")
+    except ImportError:
+        log.info("[INFO] cryptg not installed, using Telethon's pure-Python AES.")
     await client.start(phone=PHONE)
-    print("✅ Telegram client connected.")
+    log.info("✅ Telegram client connected.")
+    enable_tcp_keepalive()
 
     if not SESSION_STRING:
         session_str = client.session.save()
-        print("=" * 60)
-        print("⚠️ SAVE THIS SESSION STRING (set as SESSION_STRING in Render):")
-        print(session_str)
-        print("=" * 60)
+        log.warning("=" * 60)
+        log.warning("⚠️ SAVE THIS SESSION STRING (set as SESSION_STRING in Render):")
+        log.warning("%s", session_str)
+        log.warning("=" * 60)
 
     try:
         source = await client.get_entity(SOURCE_CHANNEL)
         target = await client.get_entity(TARGET_CHANNEL)
-        print(f"Monitoring: {getattr(source, 'title', SOURCE_CHANNEL)}")
-        print(f"Forwarding to: {getattr(target, 'title', TARGET_CHANNEL)}")
+        # Derive the InputPeers from the entities fetched above, no extra lookups
+        source_peer = utils.get_input_peer(source)
+        target_peer = utils.get_input_peer(target)
+        log.info("Monitoring: %s", getattr(source, 'title', SOURCE_CHANNEL))
+        log.info("Forwarding to: %s", getattr(target, 'title', TARGET_CHANNEL))
     except Exception as e:
-        print(f"[Error] Accessing channels: {e}")
+        log.error("[Error] Accessing channels: %s", e)
         return
 
-    threading.Thread(target=self_ping, daemon=True).start()
+    # Created on the running loop; Python < 3.10 binds a Queue to the loop
+    # current at construction, which at import time is not asyncio.run()'s
+    send_queue = asyncio.Queue(maxsize=1000)
+    tasks = [
+        asyncio.create_task(sender()),
+        asyncio.create_task(prune_processed()),
+    ]
+    # Marked integer id: the filter becomes a plain set membership test
+    client.add_event_handler(
+        handler, events.NewMessage(chats=utils.get_peer_id(source_peer))
+    )
+
     await start_web_server()
+
+    # Telethon keeps the MTProto connection alive itself; the self-ping only
+    # exists to stop Render from idling the web service
+    if RENDER_URL:
+        tasks.append(asyncio.create_task(self_ping()))
+    else:
+        log.warning("[WARN] No RENDER_URL set. Skipping ping.")
+
     await client.run_until_disconnected()
+    for task in tasks:
+        task.cancel()
 
 
 if __name__ == "__main__":
+    try:
+        import uvloop  # optional, faster event loop on Linux
+        uvloop.install()
+    except ImportError:
+        pass
+
+    log_listener.start()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        print("Bot stopped manually.")
+        log.info("Bot stopped manually.")
     except Exception as e:
-        print(f"[FatalError] {e}")
+        log.error("[FatalError] %s", e)
+    finally:
+        log_listener.stop()